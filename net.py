@@ -4,6 +4,7 @@ import numpy as np
 
 import chainer
 from chainer import cuda
+from chainer import function_node
 import chainer.functions as F
 import chainer.links as L
 from chainer import reporter
@@ -14,6 +15,17 @@ from train import source_pad_concat_convert
 linear_init = chainer.initializers.LeCunUniform()
 
 
+def get_dtype():
+    """ Get the dtype of parameters and activations
+
+    It is given by ``chainer.config.dtype`` (Chainer v4 or later),
+    and is float32 for older versions without the config.
+
+    """
+
+    return np.dtype(getattr(chainer.config, 'dtype', np.float32))
+
+
 def sentence_block_embed(embed, x):
     """ Change implicitly embed_id function's target to ndim=2
 
@@ -27,7 +39,7 @@ def sentence_block_embed(embed, x):
     _, units = embed.W.shape
     e = embed(x.reshape((batch * length, )))
     assert(e.shape == (batch * length, units))
-    e = F.transpose(F.stack(F.split_axis(e, batch, axis=0), axis=0), (0, 2, 1))
+    e = F.transpose(F.reshape(e, (batch, length, units)), (0, 2, 1))
     assert(e.shape == (batch, units, length))
     return e
 
@@ -52,6 +64,71 @@ def seq_func(func, x, reconstruct_shape=True):
     return e
 
 
+class DropoutAdd(function_node.FunctionNode):
+
+    """ Residual connection with dropout on the added sub-layer output
+
+    Compute ``x + dropout(sub)`` at once. On GPU, the dropout mask and
+    the sum are made in a single elementwise kernel.
+
+    """
+
+    def __init__(self, dropout_ratio):
+        self.dropout_ratio = dropout_ratio
+
+    def forward(self, inputs):
+        x, sub = inputs
+        xp = cuda.get_array_module(x)
+        scale = 1. / (1 - self.dropout_ratio)
+        if xp is np:
+            flag = np.random.rand(*sub.shape) >= self.dropout_ratio
+            self.mask = (scale * flag).astype(sub.dtype)
+            y = x + sub * self.mask
+        else:
+            rand = xp.random.rand(*sub.shape, dtype=np.float32)
+            self.mask, y = cuda.elementwise(
+                'T x, T sub, float32 rand, float32 ratio, float32 scale',
+                'T mask, T y',
+                '''
+                mask = rand >= ratio ? (T)scale : (T)0;
+                y = x + sub * mask;
+                ''',
+                'dropout_add_fwd')(x, sub, rand, self.dropout_ratio, scale)
+        return y,
+
+    def backward(self, indexes, grad_outputs):
+        gy, = grad_outputs
+        ret = []
+        if 0 in indexes:
+            ret.append(gy)
+        if 1 in indexes:
+            ret.append(DropoutGrad(self.mask).apply((gy,))[0])
+        return ret
+
+
+class DropoutGrad(function_node.FunctionNode):
+
+    """ Multiply a fixed dropout mask, as the gradient of dropout """
+
+    def __init__(self, mask):
+        self.mask = mask
+
+    def forward(self, inputs):
+        y = inputs[0] * self.mask
+        return y,
+
+    def backward(self, indexes, grad_outputs):
+        return DropoutGrad(self.mask).apply(grad_outputs)
+
+
+def dropout_add(x, sub, ratio=.5):
+    """ Add ``sub`` to ``x`` with dropout on ``sub`` in training mode """
+
+    if chainer.config.train:
+        return DropoutAdd(ratio).apply((x, sub))[0]
+    return x + sub
+
+
 class LayerNormalizationSentence(L.LayerNormalization):
 
     """ Position-wise Linear Layer for Sentence Block
@@ -64,27 +141,35 @@ class LayerNormalizationSentence(L.LayerNormalization):
     def __init__(self, *args, **kwargs):
         super(LayerNormalizationSentence, self).__init__(*args, **kwargs)
 
+    def normalize(self, x):
+        if x.dtype == np.float32:
+            return super(LayerNormalizationSentence, self).__call__(x)
+        # Normalize in float32, as it is numerically sensitive
+        y = F.layer_normalization(
+            F.cast(x, np.float32), F.cast(self.gamma, np.float32),
+            F.cast(self.beta, np.float32), self.eps)
+        return F.cast(y, x.dtype)
+
     def __call__(self, x):
-        y = seq_func(super(LayerNormalizationSentence, self).__call__, x)
+        y = seq_func(self.normalize, x)
         return y
 
 
-class ConvolutionSentence(L.Convolution2D):
+class ConvolutionSentence(L.Linear):
 
     """ Position-wise Linear Layer for Sentence Block
 
     Position-wise linear layer for array of shape
-    (batchsize, dimension, sentence_length)
-    can be implemented a convolution layer.
+    (batchsize, dimension, sentence_length).
+    It is equivalent to a 1x1 convolution, but is applied as a plain linear
+    layer over all positions at once.
 
     """
 
-    def __init__(self, in_channels, out_channels,
-                 ksize=1, stride=1, pad=0, nobias=False,
+    def __init__(self, in_channels, out_channels, nobias=False,
                  initialW=None, initial_bias=None):
         super(ConvolutionSentence, self).__init__(
-            in_channels, out_channels,
-            ksize, stride, pad, nobias,
+            in_channels, out_channels, nobias,
             initialW, initial_bias)
 
     def __call__(self, x):
@@ -99,12 +184,29 @@ class ConvolutionSentence(L.Convolution2D):
                 (batchsize, out_channels, sentence_length).
 
         """
-        x = F.expand_dims(x, axis=3)
-        y = super(ConvolutionSentence, self).__call__(x)
-        y = F.squeeze(y, axis=3)
+        y = seq_func(super(ConvolutionSentence, self).__call__, x)
         return y
 
 
+def scaled_dot_product_attention(batch_Q, batch_K, batch_V, add_mask, scale):
+    """ Scaled dot-product attention for pseudo batch of heads
+
+    Calculate weighted sums of values by softmax of scaled query-key scores
+    plus additive mask, for queries of shape (batchsize * h, units, n_querys)
+    and keys and values of shape (batchsize * h, units, n_keys).
+    The scale is applied to the queries before the product.
+
+    """
+
+    batch_A = F.matmul(batch_Q * scale, batch_K, transa=True)
+    batch_A = F.softmax(batch_A + add_mask, axis=2)
+    assert(batch_A.shape == add_mask.shape)
+
+    # Calculate Weighted Sum
+    batch_C = F.matmul(batch_V, batch_A, transb=True)
+    return batch_C
+
+
 class MultiHeadAttention(chainer.Chain):
 
     """ Multi Head Attention Layer for Sentence Blocks
@@ -136,45 +238,71 @@ class MultiHeadAttention(chainer.Chain):
         self.dropout = dropout
         self.is_self_attention = self_attention
 
-    def __call__(self, x, z=None, mask=None):
-        xp = self.xp
-        h = self.h
+    def split_heads(self, x, n_parts):
+        """ Split fused projections into pseudo batches of heads
 
-        if self.is_self_attention:
-            Q, K, V = F.split_axis(self.W_QKV(x), 3, axis=1)
-        else:
-            Q = self.W_Q(x)
-            K, V = F.split_axis(self.W_KV(z), 2, axis=1)
-        batch, n_units, n_querys = Q.shape
-        _, _, n_keys = K.shape
+        Reshape an array of shape (batchsize, n_parts * n_units, length)
+        into n_parts arrays of shape (batchsize * h, n_units // h, length)
+        with a single transpose, instead of splitting and concatenating
+        every part head by head. Heads of each sentence are adjacent in the
+        pseudo batch, so that they are merged back by a reshape.
+
+        """
+
+        batch, units, length = x.shape
+        units_h = units // n_parts // self.h
+        x = F.reshape(x, (batch, n_parts, self.h, units_h, length))
+        x = F.transpose(x, (1, 0, 2, 3, 4))
+        x = F.reshape(x, (n_parts, batch * self.h, units_h, length))
+        return [x[i] for i in range(n_parts)]
+
+    def __call__(self, x, z=None, mask=None, cache=None):
+        """Applies the attention layer.
+
+        Args:
+            x (~chainer.Variable): Query block.
+            z (~chainer.Variable): Key-value block for source attention.
+            mask (array): Additive mask of shape
+                (batchsize * h, n_querys, n_keys) tiled for heads, made by
+                :meth:`Transformer.make_attention_bias`.
+            cache (dict): Keys and values of earlier calls for incremental
+                decoding. For self attention, ``x`` holds only the new
+                positions and their keys and values are appended to the
+                cached ones. For source attention, keys and values of ``z``
+                are computed at the first call and reused afterwards.
+
+        """
+        h = self.h
 
-        # Calculate Attention Scores with Mask for Zero-padded Areas
         # Perform Multi-head Attention using pseudo batching
         # all together at once for efficiency
+        if self.is_self_attention:
+            batch_Q, batch_K, batch_V = self.split_heads(self.W_QKV(x), 3)
+            if cache is not None:
+                if 'K' in cache:
+                    batch_K = F.concat([cache['K'], batch_K], axis=2)
+                    batch_V = F.concat([cache['V'], batch_V], axis=2)
+                cache['K'], cache['V'] = batch_K, batch_V
+        else:
+            batch_Q, = self.split_heads(self.W_Q(x), 1)
+            if cache is not None and 'K' in cache:
+                batch_K, batch_V = cache['K'], cache['V']
+            else:
+                batch_K, batch_V = self.split_heads(self.W_KV(z), 2)
+                if cache is not None:
+                    cache['K'], cache['V'] = batch_K, batch_V
+        batch_h, units_h, n_querys = batch_Q.shape
+        _, _, n_keys = batch_K.shape
+        batch, n_units = batch_h // h, units_h * h
 
-        batch_Q = F.concat(F.split_axis(Q, h, axis=1), axis=0)
-        batch_K = F.concat(F.split_axis(K, h, axis=1), axis=0)
-        batch_V = F.concat(F.split_axis(V, h, axis=1), axis=0)
-        assert(batch_Q.shape == (batch * h, n_units // h, n_querys))
         assert(batch_K.shape == (batch * h, n_units // h, n_keys))
         assert(batch_V.shape == (batch * h, n_units // h, n_keys))
 
-        mask = xp.concatenate([mask] * h, axis=0)
-        batch_A = F.batch_matmul(batch_Q, batch_K, transa=True) \
-            * self.scale_score
-        batch_A = F.where(mask, batch_A, xp.full(batch_A.shape, -np.inf, 'f'))
-        batch_A = F.softmax(batch_A, axis=2)
-        batch_A = F.where(
-            xp.isnan(batch_A.data), xp.zeros(batch_A.shape, 'f'), batch_A)
-        assert(batch_A.shape == (batch * h, n_querys, n_keys))
-
-        # Calculate Weighted Sum
-        batch_A, batch_V = F.broadcast(
-            batch_A[:, None], batch_V[:, :, None])
-        batch_C = F.sum(batch_A * batch_V, axis=3)
+        # Calculate Attention Scores with Mask for Zero-padded Areas
+        batch_C = scaled_dot_product_attention(
+            batch_Q, batch_K, batch_V, mask, self.scale_score)
         assert(batch_C.shape == (batch * h, n_units // h, n_querys))
-        C = F.concat(F.split_axis(batch_C, h, axis=0), axis=1)
-        assert(C.shape == (batch, n_units, n_querys))
+        C = F.reshape(batch_C, (batch, n_units, n_querys))
         C = self.finishing_linear_layer(C)
         return C
 
@@ -210,11 +338,11 @@ class EncoderLayer(chainer.Chain):
 
     def __call__(self, e, xx_mask):
         sub = self.self_attention(e, e, xx_mask)
-        e = e + F.dropout(sub, self.dropout)
+        e = dropout_add(e, sub, self.dropout)
         e = self.ln_1(e)
 
         sub = self.feed_forward(e)
-        e = e + F.dropout(sub, self.dropout)
+        e = dropout_add(e, sub, self.dropout)
         e = self.ln_2(e)
         return e
 
@@ -232,17 +360,23 @@ class DecoderLayer(chainer.Chain):
             self.ln_3 = LayerNormalizationSentence(n_units, eps=1e-6)
         self.dropout = dropout
 
-    def __call__(self, e, s, xy_mask, yy_mask):
-        sub = self.self_attention(e, e, yy_mask)
-        e = e + F.dropout(sub, self.dropout)
+    def __call__(self, e, s, xy_mask, yy_mask, cache=None):
+        if cache is None:
+            self_cache, source_cache = None, None
+        else:
+            self_cache = cache.setdefault('self_attention', {})
+            source_cache = cache.setdefault('source_attention', {})
+
+        sub = self.self_attention(e, e, yy_mask, cache=self_cache)
+        e = dropout_add(e, sub, self.dropout)
         e = self.ln_1(e)
 
-        sub = self.source_attention(e, s, xy_mask)
-        e = e + F.dropout(sub, self.dropout)
+        sub = self.source_attention(e, s, xy_mask, cache=source_cache)
+        e = dropout_add(e, sub, self.dropout)
         e = self.ln_2(e)
 
         sub = self.feed_forward(e)
-        e = e + F.dropout(sub, self.dropout)
+        e = dropout_add(e, sub, self.dropout)
         e = self.ln_3(e)
         return e
 
@@ -273,9 +407,10 @@ class Decoder(chainer.Chain):
             self.add_link(name, layer)
             self.layer_names.append(name)
 
-    def __call__(self, e, source, xy_mask, yy_mask):
+    def __call__(self, e, source, xy_mask, yy_mask, cache=None):
         for name in self.layer_names:
-            e = getattr(self, name)(e, source, xy_mask, yy_mask)
+            layer_cache = None if cache is None else cache.setdefault(name, {})
+            e = getattr(self, name)(e, source, xy_mask, yy_mask, layer_cache)
         return e
 
 
@@ -299,10 +434,12 @@ class Transformer(chainer.Chain):
 
         self.n_layers = n_layers
         self.n_units = n_units
+        self.h = h
         self.n_target_vocab = n_target_vocab
         self.dropout = dropout
         self.use_label_smoothing = use_label_smoothing
         self.initialize_position_encoding(max_length, n_units)
+        self._history_mask = None
         self.scale_emb = self.n_units ** 0.5
 
     def initialize_position_encoding(self, length, n_units):
@@ -331,49 +468,82 @@ class Transformer(chainer.Chain):
             (float(num_timescales) - 1))
         inv_timescales = 1. * xp.exp(
             xp.arange(num_timescales).astype('f') * -log_timescale_increment)
-        scaled_time = \
-            xp.expand_dims(position, 1) * \
-            xp.expand_dims(inv_timescales, 0)
+        # Made directly in (channels, length) layout, without transpose
+        scaled_time = xp.outer(inv_timescales, position)
         signal = xp.concatenate(
-            [xp.sin(scaled_time), xp.cos(scaled_time)], axis=1)
-        signal = xp.reshape(signal, [1, length, channels])
-        self.position_encoding_block = xp.transpose(signal, (0, 2, 1))
+            [xp.sin(scaled_time), xp.cos(scaled_time)], axis=0)
+        position_encoding_block = signal[None].astype(get_dtype())
+        # Register as persistent so that to_gpu/to_cpu move it with the model
+        self.add_persistent('position_encoding_block', position_encoding_block)
 
-    def make_input_embedding(self, embed, block):
+    def make_input_embedding(self, embed, block, offset=0):
+        xp = self.xp
         batch, length = block.shape
         emb_block = sentence_block_embed(embed, block) * self.scale_emb
-        emb_block += self.xp.array(self.position_encoding_block[:, :, :length])
+        emb_block += self.position_encoding_block[
+            :, :, offset:offset + length]
         if hasattr(self, 'embed_pos'):
+            position = xp.arange(offset, offset + length).astype('i')
             emb_block += sentence_block_embed(
                 self.embed_pos,
-                self.xp.broadcast_to(
-                    self.xp.arange(length).astype('i')[None, :], block.shape))
-        emb_block = F.dropout(emb_block, self.dropout)
+                xp.broadcast_to(position[None, :], block.shape))
+        if chainer.config.train:
+            emb_block = F.dropout(emb_block, self.dropout)
         return emb_block
 
     def make_attention_mask(self, source_block, target_block):
-        mask = (target_block[:, None, :] >= 0) * \
-            (source_block[:, :, None] >= 0)
+        # Comparisons are made on the (batch, length) blocks, and only the
+        # broadcast logical_and passes over the full mask
+        mask = self.xp.logical_and(
+            (target_block >= 0)[:, None, :], (source_block >= 0)[:, :, None])
         # (batch, source_length, target_length)
         return mask
 
     def make_history_mask(self, block):
+        xp = self.xp
         batch, length = block.shape
-        arange = self.xp.arange(length)
-        history_mask = (arange[None, ] <= arange[:, None])[None, ]
-        history_mask = self.xp.broadcast_to(
+        # Keep only the largest mask made so far, as masks of any shorter
+        # length are its top-left slices
+        cached = self._history_mask
+        if cached is None or cached.shape[1] < length or \
+                cuda.get_array_module(cached) is not xp:
+            arange = xp.arange(length)
+            self._history_mask = (arange[None, ] <= arange[:, None])[None, ]
+        history_mask = self._history_mask[:, :length, :length]
+        history_mask = xp.broadcast_to(
             history_mask, (batch, length, length))
         return history_mask
 
+    def make_attention_bias(self, mask):
+        """ Convert a boolean mask into additive mask for attention layers
+
+        Make an array of shape (batch * h, n_querys, n_keys) tiled for
+        the pseudo batch of heads, once for all the layers.
+
+        """
+
+        xp = self.xp
+        dtype = get_dtype()
+        # Masked scores get a large negative bias instead of -inf, so that
+        # rows without any valid key give no NaN after softmax
+        # (kept finite also for float16, whose maximum is 65504)
+        mask_value = -min(1e9, np.finfo(dtype).max / 2)
+        bias = xp.where(mask, dtype.type(0), dtype.type(mask_value))
+        return xp.repeat(bias, self.h, axis=0)
+
     def output(self, h):
         return F.linear(h, self.embed_y.W)
 
     def output_and_loss(self, h_block, t_block):
+        xp = self.xp
         batch, units, length = h_block.shape
 
         # Output (all together at once for efficiency)
         concat_logit_block = seq_func(self.output, h_block,
                                       reconstruct_shape=False)
+        if concat_logit_block.dtype != np.float32:
+            # Compute the loss in float32
+            concat_logit_block = F.cast(concat_logit_block, np.float32)
         rebatch, _ = concat_logit_block.shape
         # Make target
         concat_t_block = t_block.reshape((rebatch))
@@ -387,16 +557,15 @@ class Transformer(chainer.Chain):
             loss = loss * n_token / normalizer
         else:
             log_prob = F.log_softmax(concat_logit_block)
-            broad_ignore_mask = self.xp.broadcast_to(
-                ignore_mask[:, None],
-                concat_logit_block.shape)
-            pre_loss = ignore_mask * \
-                log_prob[self.xp.arange(rebatch), concat_t_block]
+            # Padding (-1) is clipped to a valid id and masked out after
+            ignore_mask_f = ignore_mask.astype(log_prob.dtype)
+            pre_loss = ignore_mask_f * F.select_item(
+                log_prob, xp.maximum(concat_t_block, 0))
             loss = - F.sum(pre_loss) / normalizer
 
         accuracy = F.accuracy(
             concat_logit_block, concat_t_block, ignore_label=-1)
-        perp = self.xp.exp(loss.data * normalizer / n_token)
+        perp = xp.exp(loss.data * normalizer / n_token)
 
         # Report the Values
         reporter.report({'loss': loss.data * normalizer / n_token,
@@ -404,32 +573,58 @@ class Transformer(chainer.Chain):
                          'perp': perp}, self)
 
         if self.use_label_smoothing:
-            label_smoothing = broad_ignore_mask * \
-                - 1. / self.n_target_vocab * log_prob
+            # Reduce over the vocabulary first, then mask per token
+            label_smoothing = ignore_mask_f * \
+                F.sum(log_prob, axis=1) * (- 1. / self.n_target_vocab)
             label_smoothing = F.sum(label_smoothing) / normalizer
             loss = 0.9 * loss + 0.1 * label_smoothing
         return loss
 
+    def encode(self, x_block):
+        """ Encode source blocks into (batch, n_units, x_length) """
+        ex_block = self.make_input_embedding(self.embed_x, x_block)
+        xx_mask = self.make_attention_mask(x_block, x_block)
+        z_blocks = self.encoder(ex_block, self.make_attention_bias(xx_mask))
+        return z_blocks
+
+    def decode(self, z_blocks, xy_mask, y_in_block, offset=0, cache=None):
+        """ Encode target blocks with encoded sources (without output)
+
+        With ``cache``, ``y_in_block`` holds only the target positions after
+        ``offset`` ones already decoded with the same cache, and all the
+        earlier positions are assumed to be valid tokens.
+
+        """
+
+        xp = self.xp
+        batch, y_length = y_in_block.shape
+        ey_block = self.make_input_embedding(
+            self.embed_y, y_in_block, offset=offset)
+        if cache is None:
+            yy_mask = self.make_attention_mask(y_in_block, y_in_block)
+            xp.logical_and(
+                yy_mask, self.make_history_mask(y_in_block), out=yy_mask)
+        else:
+            arange = xp.arange(offset + y_length)
+            yy_mask = xp.broadcast_to(
+                (arange[None, ] <= arange[offset:, None])[None, ],
+                (batch, y_length, offset + y_length))
+        h_block = self.decoder(
+            ey_block, z_blocks, self.make_attention_bias(xy_mask),
+            self.make_attention_bias(yy_mask), cache)
+        return h_block
+
     def __call__(self, x_block, y_in_block, y_out_block, get_prediction=False):
         batch, x_length = x_block.shape
         batch, y_length = y_in_block.shape
 
-        # Make Embedding
-        ex_block = self.make_input_embedding(self.embed_x, x_block)
-        ey_block = self.make_input_embedding(self.embed_y, y_in_block)
-
-        # Make Masks
-        xx_mask = self.make_attention_mask(x_block, x_block)
-        xy_mask = self.make_attention_mask(y_in_block, x_block)
-        yy_mask = self.make_attention_mask(y_in_block, y_in_block)
-        yy_mask *= self.make_history_mask(y_in_block)
-
         # Encode Sources
-        z_blocks = self.encoder(ex_block, xx_mask)
+        z_blocks = self.encode(x_block)
         # [(batch, n_units, x_length), ...]
 
         # Encode Targets with Sources (Decode without Output)
-        h_block = self.decoder(ey_block, z_blocks, xy_mask, yy_mask)
+        xy_mask = self.make_attention_mask(y_in_block, x_block)
+        h_block = self.decode(z_blocks, xy_mask, y_in_block)
         # (batch, n_units, y_length)
 
         if get_prediction:
@@ -441,71 +636,88 @@ class Transformer(chainer.Chain):
         if beam:
             return self.translate_beam(x_block, max_length, beam)
 
-        # TODO: efficient inference by re-using result
+        xp = self.xp
+
         with chainer.no_backprop_mode():
             with chainer.using_config('train', False):
                 x_block = source_pad_concat_convert(
                     x_block, device=None)
                 batch, x_length = x_block.shape
-                # y_block = self.xp.zeros((batch, 1), dtype=x_block.dtype)
-                y_block = self.xp.full(
+                # y_block = xp.zeros((batch, 1), dtype=x_block.dtype)
+                y_block = xp.full(
                     (batch, 1), 2, dtype=x_block.dtype)  # bos
-                eos_flags = self.xp.zeros((batch, ), dtype=x_block.dtype)
+                eos_flags = xp.zeros((batch, ), dtype=x_block.dtype)
                 result = []
+
+                # Encode sources only once
+                z_blocks = self.encode(x_block)
+                xy_mask = self.make_attention_mask(y_block, x_block)
+
+                # Decode one position at a time, re-using keys and values
+                # of previous positions kept in the cache
+                cache = {}
                 for i in range(max_length):
-                    log_prob_tail = self(x_block, y_block, y_block,
-                                         get_prediction=True)
-                    ys = self.xp.argmax(log_prob_tail.data, axis=1).astype('i')
+                    h_block = self.decode(
+                        z_blocks, xy_mask, y_block, offset=i, cache=cache)
+                    log_prob_tail = self.output(h_block[:, :, -1])
+                    ys = xp.argmax(log_prob_tail.data, axis=1).astype('i')
                     result.append(ys)
-                    y_block = F.concat([y_block, ys[:, None]], axis=1).data
+                    y_block = ys[:, None]
                     eos_flags += (ys == 0)
-                    if self.xp.all(eos_flags):
+                    # Checking flags syncs GPU with host and stalls kernel
+                    # dispatch, so it is done every few steps on GPU.
+                    # Extra steps after all EOS are cut off below
+                    if xp is not np and (i + 1) % 4 != 0:
+                        continue
+                    if xp.all(eos_flags):
                         break
 
-        result = cuda.to_cpu(self.xp.stack(result).T)
+        result = cuda.to_cpu(xp.stack(result).T)
 
         # Remove EOS taggs
-        outs = []
-        for y in result:
-            inds = np.argwhere(y == 0)
-            if len(inds) > 0:
-                y = y[:inds[0, 0]]
-            if len(y) == 0:
-                y = np.array([1], 'i')
-            outs.append(y)
+        is_eos = (result == 0)
+        lengths = np.where(is_eos.any(axis=1),
+                           np.argmax(is_eos, axis=1), result.shape[1])
+        outs = [y[:length] if length > 0 else np.array([1], 'i')
+                for y, length in zip(result, lengths)]
         return outs
 
     def translate_beam(self, x_block, max_length=50, beam=5):
-        # TODO: efficient inference by re-using result
+        # TODO: re-use keys and values of previous steps
         # TODO: batch processing
+        xp = self.xp
         with chainer.no_backprop_mode():
             with chainer.using_config('train', False):
                 x_block = source_pad_concat_convert(
                     x_block, device=None)
                 batch, x_length = x_block.shape
                 assert batch == 1, 'Batch processing is not supported now.'
-                y_block = self.xp.full(
+                y_block = xp.full(
                     (batch, 1), 2, dtype=x_block.dtype)  # bos
-                eos_flags = self.xp.zeros(
+                eos_flags = xp.zeros(
                     (batch * beam, ), dtype=x_block.dtype)
-                sum_scores = self.xp.zeros(1, 'f')
+                sum_scores = xp.zeros(1, 'f')
                 result = [[2]] * batch * beam
+
+                # Encode sources only once
+                z_blocks = self.encode(x_block)
                 for i in range(max_length):
-                    log_prob_tail = self(x_block, y_block, y_block,
-                                         get_prediction=True)
+                    xy_mask = self.make_attention_mask(y_block, x_block)
+                    h_block = self.decode(z_blocks, xy_mask, y_block)
+                    log_prob_tail = self.output(h_block[:, :, -1])
 
                     ys_list, ws_list = get_topk(
                         log_prob_tail.data, beam, axis=1)
-                    ys_concat = self.xp.concatenate(ys_list, axis=0)
+                    ys_concat = xp.concatenate(ys_list, axis=0)
                     sum_ws_list = [ws + sum_scores for ws in ws_list]
-                    sum_ws_concat = self.xp.concatenate(sum_ws_list, axis=0)
+                    sum_ws_concat = xp.concatenate(sum_ws_list, axis=0)
 
                     # Get top-k from total candidates
                     idx_list, sum_w_list = get_topk(
                         sum_ws_concat, beam, axis=0)
-                    idx_concat = self.xp.stack(idx_list, axis=0)
+                    idx_concat = xp.stack(idx_list, axis=0)
                     ys = ys_concat[idx_concat]
-                    sum_scores = self.xp.stack(sum_w_list, axis=0)
+                    sum_scores = xp.stack(sum_w_list, axis=0)
 
                     if i != 0:
                         old_idx_list = (idx_concat % beam).tolist()
@@ -515,12 +727,16 @@ class Transformer(chainer.Chain):
                     result = [result[idx] + [y]
                               for idx, y in zip(old_idx_list, ys.tolist())]
 
-                    y_block = self.xp.array(result).astype('i')
+                    y_block = xp.array(result).astype('i')
                     if x_block.shape[0] != y_block.shape[0]:
-                        x_block = self.xp.broadcast_to(
+                        x_block = xp.broadcast_to(
                             x_block, (y_block.shape[0], x_block.shape[1]))
+                        _, n_units, _ = z_blocks.shape
+                        z_blocks = F.broadcast_to(
+                            z_blocks,
+                            (y_block.shape[0], n_units, x_block.shape[1]))
                     eos_flags += (ys == 0)
-                    if self.xp.all(eos_flags):
+                    if xp.all(eos_flags):
                         break
 
         outs = [[wi for wi in sent if wi not in [2, 0]] for sent in result]
@@ -167,6 +167,10 @@ def main():
     parser.add_argument('--use-fixed-lr', action='store_true',
                         help='Use fixed learning rate rather than the ' +
                              'annealing proposed in the paper')
+    parser.add_argument('--fp16', action='store_true',
+                        help='Use float16 for parameters and activations ' +
+                             'with float32 master weights and loss scaling ' +
+                             '(Chainer v5+)')
     args = parser.parse_args()
     print(json.dumps(args.__dict__, indent=4))
 
@@ -200,6 +204,9 @@ def main():
     target_words = {i: w for w, i in target_ids.items()}
     source_words = {i: w for w, i in source_ids.items()}
 
+    if args.fp16:
+        chainer.global_config.dtype = numpy.float16
+
     # Define Model
     model = net.Transformer(
         args.layer,
@@ -223,6 +230,11 @@ def main():
         eps=1e-9
     )
     optimizer.setup(model)
+    if args.fp16:
+        # Keep float32 copies of parameters for updates, and scale the loss
+        # dynamically so that small float16 gradients do not underflow
+        optimizer.use_fp32_update()
+        optimizer.loss_scaling()
 
     # Setup Trainer
     train_iter = chainer.iterators.SerialIterator(train_data, args.batchsize)